@@ -1,10 +1,121 @@
 import openml
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import json
+import os
+import math
 import time
+import random
+import xml.parsers.expat
+import queue
+import threading
+import atexit
+import warnings
+import logging
+import hashlib
+import importlib.util
+from itertools import groupby
+from collections import OrderedDict
+import joblib
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from copy import deepcopy
 
+def _finite(obj):
+    """replaces nan and inf with None, anywhere in a payload
+    """
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+#orjson is considerably faster at encoding and decoding payloads, but is optional.
+#orjson sends non-finite floats (e.g. a diverged loss) as null, so the json
+#fallback does the same, otherwise what's recorded would depend on the install
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    def _dumps(obj):
+        return json.dumps(_finite(obj))
+    _loads = json.loads
+
+#metric updates are posted in batches of up to this many, or whatever has
+#queued up after this many seconds
+_METRIC_BATCH_SIZE = 32
+_METRIC_FLUSH_INTERVAL = 1.0
+
+#warning suppression is process wide, so it's only applied once. Every filter
+#added is scanned on every warning issued, by every library.
+_WARN_SILENCED = False
+
+def _silence_warnings():
+    global _WARN_SILENCED
+    if _WARN_SILENCED:
+        return
+    warnings.filterwarnings("ignore")
+    logging.getLogger().setLevel(logging.ERROR)
+    _WARN_SILENCED = True
+
+#openml's error code for "Database connection error", which happens under load
+_OPML_DB_CONNECTION_ERROR = 107
+
+def _is_transient(e):
+    """whether an error is worth retrying
+    connection problems, openml's database connection error, and responses
+    openml couldn't parse (e.g. a gateway error page) are. Errors openml parsed
+    out of a response (unknown ids, no results, bad credentials) are
+    deterministic, so they aren't.
+    """
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(e, openml.exceptions.OpenMLServerException):
+        return e.code == _OPML_DB_CONNECTION_ERROR
+    if isinstance(e, openml.exceptions.OpenMLNotAuthorizedError):
+        return False
+    if isinstance(e, openml.exceptions.OpenMLServerError):
+        return isinstance(e.__cause__, xml.parsers.expat.ExpatError)
+    return False
+
+def _retry(fn, *args, max_delay_exp=3, **kwargs):
+    """calls fn, retrying with exponential backoff on transient server errors
+    openml is known to throw 502s under load, which would otherwise crash the
+    whole run. sleeps 2**i + jitter seconds between attempts.
+
+    openml already retries each request a few times (connection_n_retries), so
+    this only needs to ride out a slightly longer hiccup. The default gives 4
+    attempts, about 10s of sleep on top of openml's own.
+    """
+    for i in range(max_delay_exp + 1):
+        try:
+            return fn(*args, **kwargs)
+        except (openml.exceptions.OpenMLServerError, requests.exceptions.RequestException) as e:
+            if i == max_delay_exp or not _is_transient(e):
+                raise
+            time.sleep(2**i + random.random())
+
+def _opml_load(dataset_id):
+    """downloads and parses an openml dataset
+    returns (X, y, categorical_indicator, attribute_names). This is the expensive
+    part of loading (ARFF parsing), so it gets wrapped in a persistent cache.
+    """
+    #openml fetches the parquet version of a dataset when the server offers one,
+    #which loads straight into typed columns rather than going through ARFF.
+    #reading parquet needs pyarrow, without it openml is told to use ARFF
+    if importlib.util.find_spec("pyarrow") is None:
+        os.environ.setdefault("OPENML_SKIP_PARQUET", "true")
+    dataset = _retry(openml.datasets.get_dataset, dataset_id, download_data=True)
+
+    return _retry(dataset.get_data,
+        dataset_format="dataframe", target=dataset.default_target_attribute)
+
 class ExperimentClient:
     """For managing communication with orchestrator and loading data
 
@@ -12,13 +123,31 @@ class ExperimentClient:
     github.
     """
 
-    def __init__(self, verbose=False, opml_regression=True, opml_classification=True, opml_purnum = True, opml_numcat = True, runs_per_pair=60, suppress_warn=True):
+    #orchestrator endpoints
+    _BASE = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint"
+    _URLS = {'registerExperiment': _BASE + "/registerExperiment",
+             'getExperiment': _BASE + "/getExperiment",
+             'beginRun': _BASE + "/beginRun",
+             'beginRunSticky': _BASE + "/beginRunSticky",
+             'getRun': _BASE + "/getRun",
+             'updateRunBatch': _BASE + "/updateRunBatch",
+             'updateRun': _BASE + "/updateRun",
+             'endRun': _BASE + "/endRun",
+             'getResults': _BASE + "/getResults",
+             'monteCarloSampleSpace': _BASE + "/monteCarloSampleSpace"}
+
+    def __init__(self, verbose=False, opml_regression=True, opml_classification=True, opml_purnum = True, opml_numcat = True, runs_per_pair=60, suppress_warn=True, task_cache_size=4, load_cache=True):
         """Initialize
         verbose: helpful printouts or not
         opml_regression: tasks regression targets
         opml_classification: tasks classification targets
         opml_purnum: tasks with pure numeric features
         opml_numcat: tasks with numeric and categorical features
+        task_cache_size: how many loaded tasks to keep in memory
+        load_cache: keep a pickle of each loaded task on disk. openml keeps its
+            own parsed copy of each dataset too, so this trades disk space (a
+            second copy of everything loaded) for skipping openml's metadata
+            requests on a repeat load
         """
 
         #no experiment defined yet
@@ -29,20 +158,63 @@ class ExperimentClient:
 
         #no run started yet
         self.run_id = None
+        self.run_open = False #true between beginning and ending a run
+
+        #last run fetched, for conditional requests in get_run
+        self._run_etag = None
+        self._run_cached = None
+        self._run_cached_id = None
+
+        #metric updates are queued, and sent in batches by a background thread
+        self._metric_queue = queue.Queue()
+        self._metric_thread = None
+        self._metric_lock = threading.Lock() #held while sending, so retries keep order
+        self._metric_failed = {} #run id -> metrics not yet sent, in order
+        self._metric_errors = {} #run id -> the last error sending its metrics
+        self._batch_endpoint = True #falls back to per-update posts if unsupported
 
         #for sticky loading
         self.stuck_task = "" #for sticking to a task w/ the orchestrator
-        self.prev_task = ""  #for managing actual task loading
-        self.prev_X = None
-        self.prev_Y = None
-        self.prev_categorical_indicator = None
-        self.prev_attribute_names = None
+        self.prev_task = ""  #most recently loaded task
+        self._prev_hash = None #hash of prev_task, lets the orchestrator know what's in memory
+
+        #persistent cache of parsed datasets, survives process restarts. Kept
+        #in ~/.openml/cache/arff_pickle, separate from openml's own cache, and
+        #moved under the cache directory init_opml sets, if it sets one
+        self.load_cache = load_cache
+        self._prefetch_thread = None
+        self._set_load_cache_dir(os.path.expanduser("~/.openml/cache"))
+
+        #one lock per dataset, so background prefetching and foreground loads
+        #never download and pickle the same dataset at the same time
+        self._load_locks = {}
+        self._load_locks_lock = threading.Lock()
+
+        #the last few tasks are also kept in memory, keyed by task string
+        self.task_cache_size = task_cache_size
+        self._task_cache = OrderedDict() #task string -> loaded task, least recent first
 
         #no secerets defined yet
         self.orchname = None
         self.orchseceret = None
         self.openMLAPIKey = None
 
+        #one session for all orchestrator calls, so connections are kept alive
+        #and pooled rather than re-handshaking on every request. Most endpoints
+        #change state (begin a run, add metrics), so they're only retried when
+        #the connection was never made. The read only endpoints also retry
+        #gateway errors and dropped responses. POST has to be allowed explicitly
+        self._session = requests.Session()
+        retries = Retry(total=6, connect=6, read=0, status=0, other=0, backoff_factor=0.5, allowed_methods=None)
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries))
+        retries_readonly = Retry(total=6, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=None)
+        readonly_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries_readonly)
+        for endpoint in ['getRun', 'getExperiment', 'getResults', 'monteCarloSampleSpace']:
+            self._session.mount(self._URLS[endpoint], readonly_adapter)
+
+        #set when mount_drive succeeds
+        self._drive_mounted = False
+
         #user defined verbosity
         self.verbose=verbose
 
@@ -62,16 +234,15 @@ class ExperimentClient:
         #get queried when openMLAPIKey is defined
         self.suites = []
         self.taskID_suite = []
+        self.suite_tasks = {} #suite id -> task listing dataframe, indexed by task id
+        self._data_groups_cache = None #result of opml_identifiers, reset by init_opml
 
         #how many times to run a hyperparameter-task pair
         self.runs_per_pair = runs_per_pair
 
         #openml has a lot of warnings which are difficult to supress atomically
         if suppress_warn:
-            import warnings
-            warnings.filterwarnings("ignore")
-            import logging
-            logging.getLogger().setLevel(logging.ERROR)
+            _silence_warnings()
 
     def mount_drive(self):
         """ Mounts a drive, if on google colab, chiefly for getting credentials
@@ -80,6 +251,7 @@ class ExperimentClient:
         """
         from google.colab import drive
         drive.mount('/content/drive', force_remount=False)
+        self._drive_mounted = True
 
     #===========================================================================
     #                      Auth and Seceret Management
@@ -95,6 +267,7 @@ class ExperimentClient:
         """
         self.orchname = orchname
         self.orchseceret = orchseceret
+        self._set_orch_headers()
 
     def define_orch_cred_drive(self, orchname, path):
         """Reads the orchestrator seceret from some drive location
@@ -103,8 +276,16 @@ class ExperimentClient:
         """
         self.orchname = orchname
         self.mount_drive()
-        with open ('/content/drive'+path, "r") as myfile:
-            self.orchseceret = myfile.read()
+        #stripped, a trailing newline would otherwise end up in the header
+        with open ('/content/drive'+path, "rb") as myfile:
+            self.orchseceret = myfile.read().strip().decode()
+        self._set_orch_headers()
+
+    def _set_orch_headers(self):
+        """Attaches the orchestrator credentials to the shared session
+        called whenever orchestrator credentials are defined
+        """
+        self._session.headers.update({'Name': self.orchname, 'Seceret': self.orchseceret, 'Content-Type': 'application/json'})
 
     def define_opml_cred(self, openMLAPIKey):
         self.openMLAPIKey = openMLAPIKey
@@ -117,8 +298,9 @@ class ExperimentClient:
         """
         #setting up API key
         self.mount_drive()
-        with open ('/content/drive'+path, "r") as myfile:
-            self.openMLAPIKey = myfile.read()
+        #stripped, a trailing newline would otherwise end up in the api key
+        with open ('/content/drive'+path, "rb") as myfile:
+            self.openMLAPIKey = myfile.read().strip().decode()
         openml.config.apikey = self.openMLAPIKey
         self.init_opml()
 
@@ -132,8 +314,58 @@ class ExperimentClient:
         """Loads suite and task information
         this automatically gets called when opml credentials are set up
         """
-        self.suites = [openml.study.get_suite(id) for id in self.suites_ids]
+        #a running prefetch uses the current cache and task listings, so it's
+        #allowed to finish before they're replaced
+        self._wait_for_prefetch()
+
+        #openml's cache is put on persistent storage when possible, so downloads
+        #are reused across sessions. OPML_CACHE takes priority over drive
+        cache_dir = os.environ.get("OPML_CACHE")
+        if cache_dir is None and self._drive_mounted:
+            cache_dir = "/content/drive/MyDrive/.openml_cache"
+        if cache_dir is not None:
+            if hasattr(openml.config, 'set_root_cache_directory'):
+                openml.config.set_root_cache_directory(cache_dir)
+            else:
+                openml.config.cache_directory = cache_dir
+            self._set_load_cache_dir(cache_dir)
+
+        #suites are independent requests, so they're fetched concurrently.
+        #listings from a previous call may be for suites no longer in use
+        self.suite_tasks = {}
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            self.suites = list(pool.map(lambda id: _retry(openml.study.get_suite, id), self.suites_ids))
+            list(pool.map(self._bulk_list_tasks, self.suites))
         self.taskID_suite = [(task_id, suite) for suite in self.suites for task_id in suite.tasks]
+        self._data_groups_cache = None
+
+    def _set_load_cache_dir(self, cache_dir):
+        """Points the persistent cache of parsed datasets at a directory
+        if the cache is turned off, datasets are loaded through openml directly
+        """
+        if not self.load_cache:
+            self._mem = None
+            self._opml_load_cached = _opml_load
+            return
+        self._mem = joblib.Memory(os.path.join(cache_dir, "arff_pickle"), verbose=0)
+        self._opml_load_cached = self._mem.cache(_opml_load)
+
+    def _bulk_list_tasks(self, suite):
+        """Lists metadata for every task in a suite with a single request
+        this resolves each task's dataset id up front, so loading a task doesn't
+        need a separate round trip per task
+        """
+        self.suite_tasks[suite.study_id] = _retry(openml.tasks.list_tasks,
+            output_format='dataframe', task_id=list(suite.tasks))
+
+    def _task_dataset_id(self, suite_id, task_id):
+        """Finds the dataset behind a task
+        uses the bulk listing when available, and falls back on querying the task
+        """
+        listing = self.suite_tasks.get(suite_id)
+        if listing is not None and task_id in listing.index:
+            return int(listing.loc[task_id, 'did'])
+        return _retry(openml.tasks.get_task, task_id, download_data=False).dataset_id
 
     def opml_identifiers(self):
         """Turns tasks into string which can be sent to orchestrator
@@ -142,12 +374,26 @@ class ExperimentClient:
         used as the data groups in the experiment definition.
 
         data_groups: dictionary of <suite>-<task> ids, grouped
+
+        the result only depends on the loaded suites, so it's computed once.
+        a copy is returned, so changes to it don't leak into the cache
         """
-        task_ids = ['{}-{}'.format(suite.study_id, task) for (task, suite) in self.taskID_suite]
-        data_groups = {'opml_reg_purnum_group': [t for t in task_ids if int(t[:3]) == 336],
-                       'opml_class_purnum_group': [t for t in task_ids if int(t[:3]) == 337],
-                       'opml_reg_numcat_group': [t for t in task_ids if int(t[:3]) == 335],
-                       'opml_class_numcat_group': [t for t in task_ids if int(t[:3]) == 334]}
+        if self._data_groups_cache is None:
+            self._data_groups_cache = self._bucket_opml_identifiers()
+        return {group: list(task_ids) for group, task_ids in self._data_groups_cache.items()}
+
+    def _bucket_opml_identifiers(self):
+        """Groups "<suiteid>-<taskid>" identifiers by suite
+        """
+
+        #single pass, bucketing by suite id
+        buckets = {336: [], 337: [], 335: [], 334: []}
+        for (task, suite) in self.taskID_suite:
+            buckets[suite.study_id].append('{}-{}'.format(suite.study_id, task))
+        data_groups = {'opml_reg_purnum_group': buckets[336],
+                       'opml_class_purnum_group': buckets[337],
+                       'opml_reg_numcat_group': buckets[335],
+                       'opml_class_numcat_group': buckets[334]}
         return data_groups
 
 
@@ -188,22 +434,33 @@ class ExperimentClient:
         #ensuring integrity
         for k, v in model_groups.items():
             #checking general content
-            if type(v) is not dict:
+            if not isinstance(v, dict):
                 raise(Exception("model group '{}' does not have a coresponding dictionary".format(k)))
-            if set(['model', 'hype']) != set(v.keys()):
+            if not (len(v) == 2 and 'model' in v and 'hype' in v):
                 raise(Exception("model group '{}' does not have the correct attributes of 'model' and 'hype', exclusively".format(k)))
-            if type(v['model']) is not str:
+            if not isinstance(v['model'], str):
                 raise(Exception("model group '{}' has a non-string model (aka model id) attribute".format(k)))
-            if type(v['hype']) is not dict:
+            if not isinstance(v['hype'], dict):
                 raise(Exception("model group '{}' has a non-dictionary hype (aka hyperparameter space) attribute".format(k)))
 
         self.model_groups=model_groups
 
-    def def_data_groups_opml(self):
+    def def_data_groups_opml(self, prefetch=False):
         """Defines data groups automatically from openml
+        prefetch: download every task in the background, so they're usually on
+        disk by the time a run asks for them. This is gigabytes of data, so it's
+        off by default
         """
         self.data_groups = self.opml_identifiers()
 
+        if prefetch:
+            if self._prefetch_thread is not None and self._prefetch_thread.is_alive():
+                if self.verbose: print('prefetch already running')
+                return
+            all_ids = [task_str for group in self.data_groups.values() for task_str in group]
+            self._prefetch_thread = threading.Thread(target=self.prefetch_tasks, args=(all_ids,), daemon=True)
+            self._prefetch_thread.start()
+
     def def_data_groups(self):
         """Allows for custom defined data groups
         """
@@ -221,28 +478,37 @@ class ExperimentClient:
         to define data and model groups first
         """
 
-        #checking integrity
-        for k, v in applications.items():
+        #checking integrity, in one flattened pass with set differences
+        dg_keys = self.data_groups.keys()
+        mg_keys = self.model_groups.keys()
 
-            if k not in self.data_groups.keys():
-                raise(Exception("data group '{}' in application not in '{}', which are the data groups specified".format(k, self.data_groups.keys())))
+        bad_dg = applications.keys() - dg_keys
+        if bad_dg:
+            k = next(k for k in applications if k in bad_dg)
+            raise(Exception("data group '{}' in application not in '{}', which are the data groups specified".format(k, dg_keys)))
 
+        for k, v in applications.items():
             if not isinstance(v, list):
                 raise(Exception("at data group '{}', '{}' should be a list of model ids, not a {}".format(k, v, type(v))))
 
-            for mid in v:
-                if type(mid) != str:
-                    raise(Exception("model id '{}', in '{}', should be of type 'str', not {}".format(mid, k, type(mid))))
+        pairs = [(k, mid) for k, v in applications.items() for mid in v]
 
-                if mid not in self.model_groups.keys():
-                    raise(Exception("model id '{}', in '{}', could not be found in defined model groups: {}".format(mid, k, self.model_groups.keys())))
+        bad_type = [(k, mid) for k, mid in pairs if not isinstance(mid, str)]
+        if bad_type:
+            k, mid = bad_type[0]
+            raise(Exception("model id '{}', in '{}', should be of type 'str', not {}".format(mid, k, type(mid))))
+
+        bad_mg = {mid for _, mid in pairs} - mg_keys
+        if bad_mg:
+            k, mid = next((k, mid) for k, mid in pairs if mid in bad_mg)
+            raise(Exception("model id '{}', in '{}', could not be found in defined model groups: {}".format(mid, k, mg_keys)))
 
         self.applications = applications
 
     def reg_experiment(self, expname):
         self.expname = expname
 
-        if type(expname) != str:
+        if not isinstance(expname, str):
             raise(Exception("expname should be a string"))
 
         if self.model_groups is None:
@@ -262,10 +528,9 @@ class ExperimentClient:
             }
         }
 
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/registerExperiment"
-        payload = json.dumps(experiment_definition)
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
-        response = requests.request("POST", url, headers=headers, data=payload)
+        url = self._URLS['registerExperiment']
+        payload = _dumps(experiment_definition)
+        response = self._session.post(url, data=payload)
         if self.verbose:
             print(response.text)
         return response.text
@@ -278,20 +543,19 @@ class ExperimentClient:
     #===========================================================================
     
     def experiment_info(self):
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/getExperiment"
-        payload = json.dumps({"experiment": self.expname})
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
-        resp = json.loads(requests.request("POST", url, headers=headers, data=payload).text)
+        url = self._URLS['getExperiment']
+        payload = _dumps({"experiment": self.expname})
+        resp = _loads(self._session.post(url, data=payload).content)
         return resp
     
     def begin_run(self):
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/beginRun"
-        payload = json.dumps({'experiment': self.expname})
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
-        self.run_id = requests.request("POST", url, headers=headers, data=payload).text
-        if self.run_id == 'experiment concluded':
+        url = self._URLS['beginRun']
+        payload = _dumps({'experiment': self.expname})
+        resp = self._session.post(url, data=payload).content
+        if resp == b'experiment concluded':
             raise(Exception("no run_id, experiment concluded!"))
-        self.run_id = self.run_id[1:-1] #trimming of quotes
+        self.run_id = resp[1:-1].decode() #trimming of quotes
+        self.run_open = True
         
         #getting run info
         currun = self.get_run()
@@ -306,14 +570,31 @@ class ExperimentClient:
     def begin_run_sticky(self):
         """
         prioritizes same dataset as previous run
+
+        also tells the orchestrator which task is already loaded, when a run is
+        still open and a task has been loaded. If it replies with 204 (no content)
+        the open run is still valid for that task, and it's fetched again (cheap
+        if it's unchanged)
         """
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/beginRunSticky"
-        payload = json.dumps({'experiment': self.expname, 'task': self.stuck_task})
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
-        self.run_id = requests.request("POST", url, headers=headers, data=payload).text
-        if self.run_id == 'experiment concluded':
+        url = self._URLS['beginRunSticky']
+        body = {'experiment': self.expname, 'task': self.stuck_task}
+        if self.run_open and self._prev_hash is not None:
+            body['cache_hash'] = self._prev_hash
+        payload = _dumps(body)
+        resp = self._session.post(url, data=payload)
+
+        if resp.status_code == 204:
+            if 'cache_hash' not in body:
+                raise(Exception("orchestrator reported the current run as valid, but there's no open run to reuse"))
+            if self.verbose:
+                print('orchestrator reports current run still valid, reusing {}'.format(self.run_id))
+            return self.get_run()
+
+        resp = resp.content
+        if resp == b'experiment concluded':
             raise(Exception("no run_id, experiment concluded!"))
-        self.run_id = self.run_id[1:-1] #trimming of quotes
+        self.run_id = resp[1:-1].decode() #trimming of quotes
+        self.run_open = True
         
         #getting run info
         currun = self.get_run()
@@ -326,29 +607,133 @@ class ExperimentClient:
         return currun
 
     def get_run(self):
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/getRun"
-        payload = json.dumps({"run": self.run_id})
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
-        currun = json.loads(requests.request("POST", url, headers=headers, data=payload).text)
+        url = self._URLS['getRun']
+        payload = _dumps({"run": self.run_id})
+
+        #if the orchestrator supports etags, an unchanged run isn't resent
+        headers = {}
+        if self._run_etag is not None and self._run_cached_id == self.run_id:
+            headers['If-None-Match'] = self._run_etag
+        resp = self._session.post(url, data=payload, headers=headers)
+
+        if resp.status_code == 304:
+            currun = deepcopy(self._run_cached)
+        else:
+            currun = _loads(resp.content)
+            self._run_etag = resp.headers.get('ETag')
+            if self._run_etag is not None:
+                self._run_cached = deepcopy(currun)
+                self._run_cached_id = self.run_id
+
         if self.verbose:
             print(currun)
         return currun
 
     def update_run(self, metrics):
-        
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/updateRun"
-        payload = json.dumps({"run": self.run_id,"metrics": metrics})
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
-        resp = requests.request("POST", url, headers=headers, data=payload).text
-        if self.verbose:
-            print(resp)
-        return resp
+        """queues metrics for the current run
+        this doesn't block, updates are sent in batches by a background thread.
+        use flush to wait for them to be sent, end_run does this automatically.
+        """
+        if self._metric_thread is None:
+            self._metric_thread = threading.Thread(target=self._metric_worker, daemon=True)
+            self._metric_thread.start()
+            #the thread is a daemon, so anything queued would be lost on exit
+            atexit.register(self._flush_at_exit)
+        self._metric_queue.put((self.run_id, metrics))
+
+    def flush(self, run_id=None):
+        """blocks until all queued metric updates have been sent
+        updates that failed to send are retried, in order. If some still can't
+        be sent they're kept for the next flush, and the error is raised.
+        run_id: only retry and report failures for this run, all runs if None
+        """
+        self._metric_queue.join()
+
+        with self._metric_lock:
+            run_ids = list(self._metric_failed) if run_id is None else [run_id]
+            for rid in run_ids:
+                pending = self._metric_failed.pop(rid, None)
+                self._metric_errors.pop(rid, None)
+                if pending:
+                    self._send_metrics(rid, pending)
+
+            for rid in run_ids:
+                if rid in self._metric_errors:
+                    raise self._metric_errors[rid]
+
+    def _flush_at_exit(self):
+        """sends queued metrics when the interpreter exits without end_run
+        """
+        try:
+            self.flush()
+        except Exception as e:
+            print('could not send metrics for runs {}: {}'.format(list(self._metric_failed), e))
+
+    def _metric_worker(self):
+        """drains the metric queue, in batches, for as long as the client lives
+        """
+        while True:
+            batch = [self._metric_queue.get()]
+            deadline = time.time() + _METRIC_FLUSH_INTERVAL
+            while len(batch) < _METRIC_BATCH_SIZE:
+                try:
+                    batch.append(self._metric_queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+
+            try:
+                with self._metric_lock:
+                    for run_id, items in groupby(batch, key=lambda item: item[0]):
+                        metrics_batch = [metrics for _, metrics in items]
+                        if run_id in self._metric_failed:
+                            #earlier updates for this run failed, these wait behind them
+                            self._metric_failed[run_id].extend(metrics_batch)
+                        else:
+                            self._send_metrics(run_id, metrics_batch)
+            finally:
+                for _ in batch:
+                    self._metric_queue.task_done()
+
+    def _send_metrics(self, run_id, metrics_batch):
+        """sends one run's metrics, batched if the orchestrator supports it
+        anything that couldn't be sent is kept in _metric_failed, along with
+        the error in _metric_errors. Called with _metric_lock held.
+        """
+        sent = 0
+        try:
+            if self._batch_endpoint:
+                url = self._URLS['updateRunBatch']
+                payload = _dumps({"run": run_id, "metrics_batch": metrics_batch})
+                resp = self._session.post(url, data=payload)
+                if resp.status_code not in (404, 405):
+                    resp.raise_for_status()
+                    if self.verbose:
+                        print(resp.text)
+                    return
+                #orchestrator doesn't support batching, send updates one by one
+                self._batch_endpoint = False
+
+            url = self._URLS['updateRun']
+            for metrics in metrics_batch:
+                payload = _dumps({"run": run_id, "metrics": metrics})
+                resp = self._session.post(url, data=payload)
+                resp.raise_for_status()
+                sent += 1
+                if self.verbose:
+                    print(resp.text)
+        except Exception as e:
+            self._metric_failed[run_id] = metrics_batch[sent:]
+            self._metric_errors[run_id] = e
 
     def end_run(self):
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/endRun"
-        payload = json.dumps({"run": self.run_id})
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
-        resp = requests.request("POST", url, headers=headers, data=payload).text
+        #only this run's metrics have to make it, failures for other runs
+        #don't keep this one open
+        self.flush(self.run_id)
+
+        url = self._URLS['endRun']
+        payload = _dumps({"run": self.run_id})
+        resp = self._session.post(url, data=payload).text
+        self.run_open = False
         if self.verbose:
             print(resp)
 
@@ -364,32 +749,73 @@ class ExperimentClient:
         """
         if self.verbose: print('downloading task {}'.format(task_str))
 
+        #least recently used cache, re-inserting moves a task to the most recent end
+        task = self._task_cache.pop(task_str, None)
+        if task is None:
+            task = self._opml_load_task(task_str)
+        if self.task_cache_size > 0:
+            self._task_cache[task_str] = task
+            while len(self._task_cache) > self.task_cache_size:
+                self._task_cache.popitem(last=False)
+        X, y, categorical_indicator, attribute_names = task
+
+        if task_str != self.prev_task:
+            self.prev_task = task_str
+            self._prev_hash = hashlib.blake2b(task_str.encode()).hexdigest()
+
+        #copies, so the in memory cache can't be modified by the caller
+        return deepcopy(X), deepcopy(y), deepcopy(categorical_indicator), deepcopy(attribute_names)
+
+    def _opml_load_task(self, task_str):
+        """
+        loads a task string from the persistent cache, or downloads it
+        only called on an in memory cache miss
+        """
+        if self.verbose: print('task not in memory, loading...')
+
         #extracting suite id and task id to load
         suite_id, task_id = task_str.split('-')
         suite_id = int(suite_id)
         task_id = int(task_id)
 
-        if task_str != self.prev_task:
-
-            if self.verbose: print('task different than previous task, downloading...')
+        dataset_id = self._task_dataset_id(suite_id, task_id)
+        return self._load_dataset(dataset_id)
 
-            dataset = openml.tasks.get_task(task_id).get_dataset()
+    def _load_dataset(self, dataset_id):
+        """loads a dataset through the persistent cache, one thread per dataset at a time
+        a thread that waited on the lock then reads what the first one cached
+        """
+        with self._load_locks_lock:
+            lock = self._load_locks.setdefault(dataset_id, threading.Lock())
+        with lock:
+            return self._opml_load_cached(dataset_id)
 
-            X, y, categorical_indicator, attribute_names = dataset.get_data(
-                dataset_format="dataframe", target=dataset.default_target_attribute)
+    def _wait_for_prefetch(self):
+        """blocks until a background prefetch, if one is running, is done
+        """
+        if self._prefetch_thread is not None and self._prefetch_thread.is_alive():
+            if self.verbose: print('waiting for prefetch to finish...')
+            self._prefetch_thread.join()
 
-            #saving to object, for sticky loading
-            self.prev_task = task_str
-            self.prev_X = deepcopy(X)
-            self.prev_Y = deepcopy(y)
-            self.prev_categorical_indicator = deepcopy(categorical_indicator)
-            self.prev_attribute_names = deepcopy(attribute_names)
+    def prefetch_tasks(self, task_strs, max_workers=8):
+        """
+        downloads and caches a list of task strings, "{siute_id}-{task_id}", concurrently
+        this populates the persistent cache without touching sticky loading, so
+        later calls to opml_load_task are served from disk.
+        """
+        if self.verbose: print('prefetching {} tasks'.format(len(task_strs)))
 
-            return X, y, categorical_indicator, attribute_names
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            #list() so exceptions from any download surface here
+            list(pool.map(self._prefetch_task, task_strs))
 
-        else:
-            if self.verbose: print('using values from previous task load, skipped download')
-            return deepcopy(self.prev_X), deepcopy(self.prev_Y), deepcopy(self.prev_categorical_indicator), deepcopy(self.prev_attribute_names)
+    def _prefetch_task(self, task_str):
+        """
+        resolves and loads a single task, run in the prefetch pool so a listing
+        miss (a get_task round trip) is also done in parallel
+        """
+        suite_id, task_id = task_str.split('-')
+        self._load_dataset(self._task_dataset_id(int(suite_id), int(task_id)))
         
     #===========================================================================
     #                              Results
@@ -406,13 +832,12 @@ class ExperimentClient:
         if self.verbose:
             print('getting results for {}....'.format(expname))
             
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/getResults"
-        payload = json.dumps({"experiment": expname})
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
+        url = self._URLS['getResults']
+        payload = _dumps({"experiment": expname})
         t1 = time.time()
-        resp_unparse = requests.request("POST", url, headers=headers, data=payload)
+        resp_unparse = self._session.post(url, data=payload)
         t2=time.time()
-        resp = json.loads(resp_unparse.text)
+        resp = _loads(resp_unparse.content)
         t3=time.time()    
         
         if self.verbose:
@@ -432,14 +857,13 @@ class ExperimentClient:
     def monte_carlo_sample_space(self, hype, n=999):
         """randomly search the selected hyperparameter space, for validation
         """
-        url = "https://us-west-2.aws.data.mongodb-api.com/app/experimentmanager-sjmvq/endpoint/monteCarloSampleSpace"
-        payload = json.dumps({"hype": hype, "n":n})
-        headers = {'Name': self.orchname,'Seceret': self.orchseceret,'Content-Type': 'application/json'}
-        resp = requests.request("POST", url, headers=headers, data=payload).text
+        url = self._URLS['monteCarloSampleSpace']
+        payload = _dumps({"hype": hype, "n":n})
+        resp = self._session.post(url, data=payload).content
         if self.verbose:
             print('sampled {} points in the space:'.format(n))
             print(hype)
-        return json.loads(resp)
+        return _loads(resp)
     
     def parse_runs(self, results):
         """parse successful runs from get_results into a dataframe including all results,
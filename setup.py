@@ -20,4 +20,5 @@ setup(name='TabularExperimentTrackerClient',
       license='MIT',
       packages=find_packages(),
       zip_safe=False,
-      install_requires=["openml", "requests"])
\ No newline at end of file
+      install_requires=["openml", "requests", "joblib"],
+      extras_require={"fast": ["orjson", "pyarrow"]})
\ No newline at end of file
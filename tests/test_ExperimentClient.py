@@ -0,0 +1,353 @@
+import atexit
+import json
+import unittest
+import unittest.mock
+import xml.parsers.expat
+
+import openml
+import requests
+
+from TabularExperimentTrackerClient import ExperimentClient as ec
+from TabularExperimentTrackerClient.ExperimentClient import ExperimentClient
+
+
+def make_response(status_code, content=b'"ok"'):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp._content = content
+    return resp
+
+
+class FakeSession:
+    """records posts, and answers with a status code per endpoint
+    posts for a run in fail_runs get a 500
+    """
+
+    def __init__(self, statuses, fail_runs=()):
+        self.statuses = statuses
+        self.fail_runs = set(fail_runs)
+        self.posts = []
+
+    def post(self, url, data=None, headers=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        body = json.loads(data)
+        self.posts.append((endpoint, body))
+        if body.get('run') in self.fail_runs:
+            return make_response(500)
+        return make_response(self.statuses.get(endpoint, 200))
+
+
+class TestMetricBatching(unittest.TestCase):
+
+    def setUp(self):
+        #a shorter batching window, still long enough to batch queued updates
+        patcher = unittest.mock.patch.object(ec, '_METRIC_FLUSH_INTERVAL', 0.2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_client(self, statuses, fail_runs=()):
+        client = ExperimentClient(suppress_warn=False)
+        client._session = FakeSession(statuses, fail_runs)
+        self.addCleanup(atexit.unregister, client._flush_at_exit)
+        return client
+
+    def test_batches_updates_per_run(self):
+        client = self.make_client({})
+        client.run_id = 'a'
+        client.update_run({'loss': 1})
+        client.update_run({'loss': 2})
+        client.run_id = 'b'
+        client.update_run({'loss': 3})
+        client.flush()
+
+        self.assertEqual(client._session.posts, [
+            ('updateRunBatch', {'run': 'a', 'metrics_batch': [{'loss': 1}, {'loss': 2}]}),
+            ('updateRunBatch', {'run': 'b', 'metrics_batch': [{'loss': 3}]})])
+
+    def test_falls_back_when_batching_unsupported(self):
+        client = self.make_client({'updateRunBatch': 404})
+        client.run_id = 'a'
+        client.update_run({'loss': 1})
+        client.update_run({'loss': 2})
+        client.flush()
+
+        self.assertEqual(client._session.posts, [
+            ('updateRunBatch', {'run': 'a', 'metrics_batch': [{'loss': 1}, {'loss': 2}]}),
+            ('updateRun', {'run': 'a', 'metrics': {'loss': 1}}),
+            ('updateRun', {'run': 'a', 'metrics': {'loss': 2}})])
+        self.assertFalse(client._batch_endpoint)
+
+    def test_failed_updates_kept_and_retried(self):
+        client = self.make_client({'updateRunBatch': 500})
+        client.run_id = 'a'
+        client.update_run({'loss': 1})
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.flush()
+        self.assertEqual(client._metric_failed, {'a': [{'loss': 1}]})
+
+        #once the orchestrator recovers, the next flush sends them
+        client._session.statuses = {}
+        client.flush()
+        self.assertEqual(client._session.posts[-1],
+            ('updateRunBatch', {'run': 'a', 'metrics_batch': [{'loss': 1}]}))
+        self.assertEqual(client._metric_failed, {})
+        self.assertTrue(client._batch_endpoint)
+
+    def test_updates_wait_behind_failed_ones(self):
+        client = self.make_client({}, fail_runs=['a'])
+        client.run_id = 'a'
+        client.update_run({'loss': 1})
+        client._metric_queue.join()
+        client.update_run({'loss': 2})
+        client._metric_queue.join()
+
+        client._session.fail_runs = set()
+        client.flush()
+        self.assertEqual(client._session.posts[-1],
+            ('updateRunBatch', {'run': 'a', 'metrics_batch': [{'loss': 1}, {'loss': 2}]}))
+
+    def test_failures_scoped_to_run(self):
+        client = self.make_client({}, fail_runs=['a'])
+        client.run_id = 'a'
+        client.update_run({'loss': 1})
+        client._metric_queue.join()
+
+        #run a's failure doesn't stop run b from ending
+        client.run_id = 'b'
+        client.update_run({'loss': 2})
+        client.end_run()
+        self.assertEqual(client._session.posts[-1], ('endRun', {'run': 'b'}))
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.flush()
+        self.assertEqual(client._metric_failed, {'a': [{'loss': 1}]})
+
+    def test_end_run_raises_fallback_errors(self):
+        client = self.make_client({'updateRunBatch': 404, 'updateRun': 500})
+        client.run_id = 'a'
+        client.update_run({'loss': 1})
+        client.update_run({'loss': 2})
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.end_run()
+        self.assertNotIn('endRun', [endpoint for endpoint, _ in client._session.posts])
+        self.assertEqual(client._metric_failed, {'a': [{'loss': 1}, {'loss': 2}]})
+
+    def test_flush_at_exit_reports_unsent(self):
+        client = self.make_client({}, fail_runs=['a'])
+        client.run_id = 'a'
+        client.update_run({'loss': 1})
+        with unittest.mock.patch('builtins.print') as mock_print:
+            client._flush_at_exit()
+        self.assertIn("['a']", mock_print.call_args[0][0])
+
+
+class RunSession:
+    """serves getRun for a set of runs, with etags unless use_etags is False
+    records the headers each request was sent with
+    """
+
+    def __init__(self, runs, use_etags=True):
+        self.runs = runs
+        self.use_etags = use_etags
+        self.headers = []
+
+    def etag(self, run_id):
+        return '"{}"'.format(hash(json.dumps(self.runs[run_id], sort_keys=True)))
+
+    def post(self, url, data=None, headers=None):
+        run_id = json.loads(data)['run']
+        self.headers.append(headers)
+        if not self.use_etags:
+            return make_response(200, json.dumps(self.runs[run_id]).encode())
+        etag = self.etag(run_id)
+        if headers.get('If-None-Match') == etag:
+            resp = make_response(304, b'')
+        else:
+            resp = make_response(200, json.dumps(self.runs[run_id]).encode())
+        resp.headers['ETag'] = etag
+        return resp
+
+
+class TestGetRun(unittest.TestCase):
+
+    def make_client(self, session):
+        client = ExperimentClient(suppress_warn=False)
+        client._session = session
+        return client
+
+    def test_unchanged_run_served_from_cache(self):
+        session = RunSession({'a': {'state': 'running'}})
+        client = self.make_client(session)
+        client.run_id = 'a'
+
+        self.assertEqual(client.get_run(), {'state': 'running'})
+        self.assertEqual(client.get_run(), {'state': 'running'})
+        self.assertEqual(session.headers[0], {})
+        self.assertEqual(session.headers[1], {'If-None-Match': session.etag('a')})
+
+    def test_cached_run_not_modifiable_by_caller(self):
+        client = self.make_client(RunSession({'a': {'state': 'running'}}))
+        client.run_id = 'a'
+        client.get_run()['state'] = 'changed'
+        self.assertEqual(client.get_run(), {'state': 'running'})
+
+    def test_changed_run_refetched(self):
+        session = RunSession({'a': {'state': 'running'}})
+        client = self.make_client(session)
+        client.run_id = 'a'
+        client.get_run()
+
+        session.runs['a'] = {'state': 'done'}
+        self.assertEqual(client.get_run(), {'state': 'done'})
+
+    def test_no_etags(self):
+        session = RunSession({'a': {'state': 'running'}}, use_etags=False)
+        client = self.make_client(session)
+        client.run_id = 'a'
+
+        client.get_run()
+        self.assertEqual(client.get_run(), {'state': 'running'})
+        self.assertEqual(session.headers, [{}, {}])
+        self.assertIsNone(client._run_cached)
+
+    def test_etag_only_sent_for_same_run(self):
+        #both runs have the same content, so the same etag
+        session = RunSession({'a': {'state': 'running'}, 'b': {'state': 'running'}})
+        client = self.make_client(session)
+        client.run_id = 'a'
+        client.get_run()
+
+        client.run_id = 'b'
+        self.assertEqual(client.get_run(), {'state': 'running'})
+        self.assertEqual(session.headers[1], {})
+        self.assertEqual(client._run_cached_id, 'b')
+
+
+class StickySession:
+    """a small orchestrator. beginRunSticky hands out new runs, or replies 204
+    to a cache_hash when reuse is True. records the body of every post
+    """
+
+    def __init__(self, reuse=True):
+        self.reuse = reuse
+        self.posts = []
+        self.runs = 0
+
+    def post(self, url, data=None, headers=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        body = json.loads(data)
+        self.posts.append((endpoint, body))
+        if endpoint == 'beginRunSticky':
+            if self.reuse and 'cache_hash' in body:
+                return make_response(204, b'')
+            self.runs += 1
+            return make_response(200, '"r{}"'.format(self.runs).encode())
+        if endpoint == 'getRun':
+            return make_response(200, json.dumps({'run': body['run'], 'mtpair_task': '336-1'}).encode())
+        return make_response(200)
+
+
+class TestBeginRunSticky(unittest.TestCase):
+
+    def make_client(self, session):
+        client = ExperimentClient(suppress_warn=False)
+        client._session = session
+        client.expname = 'e'
+        client._opml_load_task = lambda task_str: (None, None, None, None)
+        return client
+
+    def sticky_bodies(self, session):
+        return [body for endpoint, body in session.posts if endpoint == 'beginRunSticky']
+
+    def test_open_run_reused_on_204(self):
+        session = StickySession()
+        client = self.make_client(session)
+        client.begin_run_sticky()
+        client.opml_load_task('336-1')
+
+        currun = client.begin_run_sticky()
+        self.assertEqual(currun['run'], 'r1')
+        self.assertEqual(client.run_id, 'r1')
+        self.assertEqual(self.sticky_bodies(session)[1]['cache_hash'], client._prev_hash)
+        #the run is fetched again, rather than served from a snapshot
+        self.assertEqual(session.posts[-1], ('getRun', {'run': 'r1'}))
+
+    def test_no_cache_hash_without_open_run(self):
+        session = StickySession()
+        client = self.make_client(session)
+        client.opml_load_task('336-1')
+        client.begin_run_sticky()
+        client.end_run()
+
+        currun = client.begin_run_sticky()
+        self.assertEqual(currun['run'], 'r2')
+        for body in self.sticky_bodies(session):
+            self.assertNotIn('cache_hash', body)
+
+    def test_no_cache_hash_without_loaded_task(self):
+        session = StickySession()
+        client = self.make_client(session)
+        client.begin_run_sticky()
+        client.begin_run_sticky()
+        for body in self.sticky_bodies(session):
+            self.assertNotIn('cache_hash', body)
+
+    def test_204_without_open_run_raises(self):
+        session = StickySession()
+        session.post = lambda url, data=None, headers=None: make_response(204, b'')
+        client = self.make_client(session)
+        with self.assertRaises(Exception):
+            client.begin_run_sticky()
+
+
+class TestPayloadEncoding(unittest.TestCase):
+
+    def test_non_finite_floats_sent_as_null(self):
+        payload = {'run': 'a', 'metrics': {'loss': float('nan'), 'grad': [float('inf'), 1.5]}}
+        expected = {'run': 'a', 'metrics': {'loss': None, 'grad': [None, 1.5]}}
+
+        self.assertEqual(json.loads(ec._dumps(payload)), expected)
+        #the json fallback, for when orjson isn't installed
+        self.assertEqual(json.loads(json.dumps(ec._finite(payload))), expected)
+
+
+class TestTransientErrors(unittest.TestCase):
+
+    def unparsed_server_error(self):
+        """what openml raises when a response body isn't xml, e.g. a 502 page"""
+        try:
+            try:
+                raise xml.parsers.expat.ExpatError('not xml')
+            except xml.parsers.expat.ExpatError as e:
+                raise openml.exceptions.OpenMLServerError('Unexpected server error') from e
+        except openml.exceptions.OpenMLServerError as e:
+            return e
+
+    def test_transient(self):
+        for e in [requests.exceptions.ConnectionError(),
+                  requests.exceptions.Timeout(),
+                  openml.exceptions.OpenMLServerException('Database connection error', code=107),
+                  self.unparsed_server_error()]:
+            self.assertTrue(ec._is_transient(e), e)
+
+    def test_not_transient(self):
+        for e in [requests.exceptions.HTTPError(),
+                  openml.exceptions.OpenMLServerException('Unknown dataset', code=111),
+                  openml.exceptions.OpenMLServerNoResult('No results', code=482),
+                  openml.exceptions.OpenMLNotAuthorizedError('bad api key'),
+                  openml.exceptions.OpenMLServerError('URI too long!'),
+                  ValueError()]:
+            self.assertFalse(ec._is_transient(e), e)
+
+    def test_retry_stops_on_deterministic_errors(self):
+        calls = []
+        def fn():
+            calls.append(1)
+            raise openml.exceptions.OpenMLServerException('Unknown dataset', code=111)
+        with self.assertRaises(openml.exceptions.OpenMLServerException):
+            ec._retry(fn)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()